@@ -1,10 +1,14 @@
 import requests
+import re
 import time
 import json
 import os
+import argparse
 import concurrent.futures
+import threading
 import logging
-from typing import List, Dict, Any, Tuple
+from enum import Enum
+from typing import List, Dict, Any, Tuple, Optional
 import google.generativeai as genai 
 import typing_extensions as typing
 
@@ -14,6 +18,35 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Base URL
 BASE_URL = "https://www.courtlistener.com/api/rest/v4"
 
+class Label(str, Enum):
+    followed = "followed"
+    distinguished = "distinguished"
+    partially_overruled = "partially overruled"
+    overruled = "overruled"
+    rejected = "rejected"
+    declined_to_follow = "declined to follow"
+    mentioned = "mentioned"
+
+class Color(str, Enum):
+    Green = "Green"
+    Blue = "Blue"
+    Yellow = "Yellow"
+    Red = "Red"
+    Gray = "Gray"
+    Orange = "Orange"
+    Purple = "Purple"
+
+# Colors follow the citation color legend used by the streamlit app
+LABEL_COLORS = {
+    Label.followed.value: Color.Green.value,
+    Label.distinguished.value: Color.Blue.value,
+    Label.partially_overruled.value: Color.Yellow.value,
+    Label.overruled.value: Color.Red.value,
+    Label.rejected.value: Color.Gray.value,
+    Label.declined_to_follow.value: Color.Orange.value,
+    Label.mentioned.value: Color.Purple.value,
+}
+
 class CitationAnalysis(typing.TypedDict):
     cited_case_name: str
     cited_case_citation: str
@@ -43,21 +76,150 @@ def make_request(url: str, headers: Dict[str, str], max_retries: int = 5, initia
     logging.error(f"Max retries reached for URL: {url}")
     return None
 
-def get_case_name(opinion_id: str, headers: Dict[str, str]) -> str:
+# Fields requested by BatchFetcher, so bulk queries skip everything the pipeline never reads
+BATCH_FIELDS = {
+    "clusters": "id,case_name,case_name_full,date_filed,citations",
+    "opinions": "id,cluster_id,plain_text,html,html_lawbox,html_columbia,html_anon_2020,xml_harvard,html_with_citations",
+}
+
+class BatchFetcher:
+    """Coalesces single cluster and opinion lookups into multi-ID `id__in` queries.
+
+    Lookups queued within `window` seconds of each other (or up to
+    `max_batch` of them) are resolved by one filtered list request, and each
+    waiting caller gets its own record back.
+    """
+
+    def __init__(self, headers: Dict[str, str], window: float = 0.05, max_batch: int = 100, base_url: str = BASE_URL):
+        self.headers = headers
+        self.base_url = base_url
+        self.window = window
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.pending = {resource: {} for resource in BATCH_FIELDS}
+        self.futures = {}
+        self.timers = {}
+        self.request_count = 0
+
+    def prefetch(self, resource: str, record_ids: List[str]) -> None:
+        for record_id in record_ids:
+            self._submit(resource, str(record_id))
+
+    def get(self, resource: str, record_id: str) -> Optional[Dict[str, Any]]:
+        future = self._submit(resource, str(record_id))
+        result = future.result()
+        with self.lock:
+            self.futures.pop((resource, str(record_id)), None)
+        return result
+
+    def _submit(self, resource: str, record_id: str) -> concurrent.futures.Future:
+        flush_now = False
+        with self.lock:
+            future = self.futures.get((resource, record_id))
+            if future is not None:
+                return future
+            future = concurrent.futures.Future()
+            self.futures[(resource, record_id)] = future
+            self.pending[resource][record_id] = future
+            if len(self.pending[resource]) >= self.max_batch:
+                flush_now = True
+            elif resource not in self.timers:
+                timer = threading.Timer(self.window, self.flush, args=(resource,))
+                timer.daemon = True
+                self.timers[resource] = timer
+                timer.start()
+        if flush_now:
+            self.flush(resource)
+        return future
+
+    def flush(self, resource: str) -> None:
+        with self.lock:
+            batch, self.pending[resource] = self.pending[resource], {}
+            timer = self.timers.pop(resource, None)
+        if timer is not None:
+            timer.cancel()
+        if not batch:
+            return
+
+        records = {}
+        try:
+            url = f"{self.base_url}/{resource}/?id__in={','.join(batch)}&fields={BATCH_FIELDS[resource]}"
+            logging.info(f"Fetching {len(batch)} {resource} in one request")
+            while url:
+                data = make_request(url, self.headers)
+                with self.lock:
+                    self.request_count += 1
+                if not data:
+                    break
+                for record in data.get('results', []):
+                    records[str(record.get('id'))] = record
+                url = data.get('next')
+        except Exception as e:
+            logging.error(f"Batch fetch of {resource} failed: {e}")
+        for record_id, future in batch.items():
+            future.set_result(records.get(record_id))
+
+# Government parties appear throughout criminal and public-law opinions, so their names say nothing about which case is cited
+GENERIC_PARTY = re.compile(
+    r"^(?:the\s+)?(?:united\s+states(?:\s+of\s+america)?|state(?:\s+of\s+[\w .]+)?|people(?:\s+of\s+the\s+state\s+of\s+[\w .]+)?|"
+    r"commonwealth(?:\s+of\s+[\w .]+)?|government(?:\s+of\s+[\w .]+)?|(?:city|county|town)\s+of\s+[\w .]+|in\s+re)$",
+    re.IGNORECASE
+)
+
+def is_generic_party(party: str) -> bool:
+    return bool(GENERIC_PARTY.match(party.strip()))
+
+def get_cluster(opinion_id: str, headers: Dict[str, str], fetcher: Optional[BatchFetcher] = None) -> Optional[Dict[str, Any]]:
+    if fetcher is not None:
+        return fetcher.get('clusters', opinion_id)
     url = f"{BASE_URL}/clusters/{opinion_id}/"
-    data = make_request(url, headers)
+    return make_request(url, headers)
+
+def cluster_citations(cluster_data: Dict[str, Any]) -> List[str]:
+    return [
+        f"{citation['volume']} {citation['reporter']} {citation['page']}"
+        for citation in cluster_data.get('citations') or []
+        if citation.get('volume') and citation.get('reporter') and citation.get('page')
+    ]
+
+def get_case_name(opinion_id: str, headers: Dict[str, str], fetcher: Optional[BatchFetcher] = None) -> str:
+    data = get_cluster(opinion_id, headers, fetcher)
     if data:
         return data.get('case_name') or data.get('case_name_full') or "Unknown Case Name"
     return "Unknown Case Name"
 
-def get_citing_opinions(opinion_id: str, headers: Dict[str, str]) -> List[Dict[str, Any]]:
+def get_citing_opinions(opinion_id: str, headers: Dict[str, str], index=None, limit: Optional[int] = 3) -> List[Dict[str, Any]]:
+    # Limit to the first three opinions by default; limit=None follows every page of the search
     url = f"{BASE_URL}/search/?q=cites%3A({opinion_id})"
-    data = make_request(url, headers)
-    if data:
-        return data.get('results', [])[:3]  # Limit to first three opinions
-    return []
+    results = []
+    while url and (limit is None or len(results) < limit):
+        data = make_request(url, headers)
+        if not data:
+            break
+        results.extend(data.get('results', []))
+        url = data.get('next')
+    if index is None:
+        return results[:limit] if limit is not None else results
+
+    # The local citation index adds the citing opinions the hosted search missed
+    local_results = {citing_opinion_id(opinion): opinion for opinion in index.find_citing_opinions(opinion_id, headers)}
+    for opinion in results:
+        local_opinion = local_results.pop(citing_opinion_id(opinion), None)
+        if local_opinion:
+            opinion['passages'] = local_opinion['passages']
+    local_only = list(local_results.values())
+    if limit is None:
+        return results + local_only
+
+    # A third of the limit (at least one slot) is kept for local-only opinions, so hosted results cannot crowd them out
+    reserved = min(len(local_only), limit, max(1, limit // 3))
+    combined = results[:limit - reserved]
+    return combined + local_only[:limit - len(combined)]
+
+def process_single_opinion(main_case_name: str, citing_case_name: str, date: str, opinion_text: str, genai_model, max_chars: Optional[int] = None) -> Dict[str, Any]:
+    if max_chars:
+        opinion_text = opinion_text[:max_chars]
 
-def process_single_opinion(main_case_name: str, citing_case_name: str, date: str, opinion_text: str, genai_model) -> Dict[str, Any]:
     prompt = f"""Analyze the following opinion text and extract information about how it cites and treats the case "{main_case_name}". 
     Provide the output in the following JSON format:
 
@@ -98,27 +260,49 @@ def process_single_opinion(main_case_name: str, citing_case_name: str, date: str
         logging.error(f"Error processing opinion {citing_case_name}: {str(e)}")
         return None
 
-def process_opinion_worker(main_case_name: str, opinion: Dict[str, Any], headers: Dict[str, str], genai_model) -> Dict[str, Any]:
-    citing_case_name = opinion.get('caseName') or opinion.get('caseNameFull', 'Unknown Case Name')
-    date_filed = opinion.get('dateFiled', 'Unknown Date')
-    
+def citing_opinion_id(opinion: Dict[str, Any]) -> Optional[str]:
+    if opinion.get('opinions') and opinion['opinions'][0].get('id'):
+        return str(opinion['opinions'][0]['id'])
+    if opinion.get('cluster_id'):
+        return f"cluster-{opinion['cluster_id']}"
+    return None
+
+def opinion_content(opinion_data: Dict[str, Any]) -> Optional[str]:
+    return opinion_data.get('plain_text') or opinion_data.get('html') or \
+        opinion_data.get('html_lawbox') or opinion_data.get('html_columbia') or \
+        opinion_data.get('html_anon_2020') or opinion_data.get('xml_harvard') or \
+        opinion_data.get('html_with_citations')
+
+def get_opinion_text(opinion: Dict[str, Any], headers: Dict[str, str], fetcher: Optional[BatchFetcher] = None) -> Optional[str]:
+    # Opinions found in the local citation index already carry the passages that cite the main case
+    if opinion.get('passages'):
+        return "\n\n".join(opinion['passages'])
+
     content = None
     if opinion.get('opinions'):
         first_opinion = opinion['opinions'][0]
         opinion_id = first_opinion.get('id')
         if opinion_id:
-            opinion_url = f"{BASE_URL}/opinions/{opinion_id}/"
-            logging.info(f"Fetching full opinion data from: {opinion_url}")
-            opinion_data = make_request(opinion_url, headers)
+            if fetcher is not None:
+                opinion_data = fetcher.get('opinions', opinion_id)
+            else:
+                opinion_url = f"{BASE_URL}/opinions/{opinion_id}/"
+                logging.info(f"Fetching full opinion data from: {opinion_url}")
+                opinion_data = make_request(opinion_url, headers)
             if opinion_data:
-                content = opinion_data.get('plain_text') or opinion_data.get('html') or \
-                        opinion_data.get('html_lawbox') or opinion_data.get('html_columbia') or \
-                        opinion_data.get('html_anon_2020') or opinion_data.get('xml_harvard') or \
-                        opinion_data.get('html_with_citations')
+                content = opinion_content(opinion_data)
+    return content
+
+def process_opinion_worker(main_case_name: str, opinion: Dict[str, Any], headers: Dict[str, str], genai_model, fetcher: Optional[BatchFetcher] = None) -> Dict[str, Any]:
+    citing_case_name = opinion.get('caseName') or opinion.get('caseNameFull', 'Unknown Case Name')
+    date_filed = opinion.get('dateFiled', 'Unknown Date')
+    
+    content = get_opinion_text(opinion, headers, fetcher)
     
     if content:
         processed_result = process_single_opinion(main_case_name, citing_case_name, date_filed, content, genai_model)
         if processed_result:
+            processed_result.setdefault('date_filed', date_filed)
             logging.info(f"Successfully processed citing opinion: {citing_case_name}")
             return processed_result
         else:
@@ -128,18 +312,23 @@ def process_opinion_worker(main_case_name: str, opinion: Dict[str, Any], headers
         logging.warning(f"No content available for citing opinion: {citing_case_name}")
         return None
 
-def process_opinion(opinion_id: str, headers: Dict[str, str], genai_model) -> Tuple[str, List[Dict[str, Any]]]:
-    main_case_name = get_case_name(opinion_id, headers)
+def process_opinion(opinion_id: str, headers: Dict[str, str], genai_model, index=None) -> Tuple[str, List[Dict[str, Any]]]:
+    fetcher = BatchFetcher(headers)
+    main_case_name = get_case_name(opinion_id, headers, fetcher)
     logging.info(f"Main Case Name for opinion {opinion_id}: {main_case_name}")
     
     logging.info(f"Fetching citing opinions for opinion ID: {opinion_id}")
-    citing_opinions = get_citing_opinions(opinion_id, headers)
+    citing_opinions = get_citing_opinions(opinion_id, headers, index)
+    
+    # Queue every opinion fetch up front so they share requests even when workers outnumber threads
+    fetcher.prefetch('opinions', [opinion['opinions'][0]['id'] for opinion in citing_opinions
+                                  if opinion.get('opinions') and opinion['opinions'][0].get('id') and not opinion.get('passages')])
     
     logging.info(f"Processing the first {len(citing_opinions)} citing opinions in parallel...")
     results = []
     
     with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_opinion = {executor.submit(process_opinion_worker, main_case_name, opinion, headers, genai_model): opinion for opinion in citing_opinions}
+        future_to_opinion = {executor.submit(process_opinion_worker, main_case_name, opinion, headers, genai_model, fetcher): opinion for opinion in citing_opinions}
         for future in concurrent.futures.as_completed(future_to_opinion):
             result = future.result()
             if result:
@@ -156,6 +345,10 @@ def save_results_to_file(main_case_name: str, results: List[Dict[str, Any]], fil
         json.dump(output, f, indent=2)
 
 def main():
+    parser = argparse.ArgumentParser(description="Opinion Citation Analyzer")
+    parser.add_argument('--index', help="Path to a local citation index database built with citator_index.py")
+    args = parser.parse_args()
+
     print("Welcome to the Opinion Citation Analyzer")
     
     auth_token = input("Please enter your Court Listener AUTH_TOKEN: ").strip()
@@ -170,7 +363,12 @@ def main():
     genai_model = genai.GenerativeModel("gemini-1.5-pro-latest")
 
     print(f"\nAnalyzing citations for Opinion ID: {opinion_id}")
-    main_case_name, results = process_opinion(opinion_id, headers, genai_model)
+    index = None
+    if args.index:
+        # citator_index imports this module, so it is only loaded when an index is used
+        from citator_index import CitationIndex
+        index = CitationIndex(args.index)
+    main_case_name, results = process_opinion(opinion_id, headers, genai_model, index)
 
     print(f"\nMain Case: {main_case_name}")
     print(f"Number of citing opinions processed: {len(results)}")
@@ -0,0 +1,299 @@
+import re
+import html
+import time
+import json
+import os
+import argparse
+import logging
+from typing import List, Dict, Any, Tuple, Optional
+import openai
+from openai import OpenAI
+from pydantic import BaseModel, Field
+
+from citator import Label, Color, BatchFetcher, get_cluster, cluster_citations, is_generic_party, get_citing_opinions, citing_opinion_id, get_opinion_text, save_results_to_file
+from citator_index import CitationIndex
+
+SYSTEM_PROMPT = "You are a legal analyst tasked with extracting citation information from legal opinions."
+
+class Case(BaseModel):
+    name: str
+    citation: str
+
+class CitingCase(Case):
+    citing_id: str
+    label: Label
+    color: Color
+    reasoning: str
+
+class BatchCitationAnalysis(BaseModel):
+    cited_case: Case
+    citing_cases: List[CitingCase] = Field(default_factory=list)
+
+# A citation context is (citing id, citing case name, date filed, passage text)
+CitationContext = Tuple[str, str, str, str]
+
+def citation_patterns(main_case_name: str, citations: Optional[List[str]] = None) -> List[str]:
+    # Reporter citations ("163 U.S. 537") match however the reporter abbreviation is spaced
+    patterns = []
+    for citation in citations or []:
+        volume, *reporter, page = citation.split()
+        reporter = re.escape("".join(reporter)).replace(r"\.", r"\.\s?")
+        patterns.append(rf"\b{re.escape(volume)}\s+{reporter}\s+{re.escape(page)}\b")
+
+    # Short-form citations refer back to a case by either party name, unless it is a government party
+    if main_case_name != "Unknown Case Name":
+        for party in re.split(r"\s+v\.?\s+", main_case_name, maxsplit=1):
+            party = party.strip()
+            if party and not is_generic_party(party):
+                patterns.append(re.escape(party))
+    return patterns
+
+def extract_citation_context(opinion_text: str, main_case_name: str, citations: Optional[List[str]] = None,
+                             window: int = 1500, max_chars: int = 6000) -> str:
+    patterns = citation_patterns(main_case_name, citations)
+    spans = []
+    if patterns:
+        for match in re.finditer("|".join(patterns), opinion_text, flags=re.IGNORECASE):
+            start, end = max(0, match.start() - window), min(len(opinion_text), match.end() + window)
+            if spans and start <= spans[-1][1]:
+                spans[-1] = (spans[-1][0], end)
+            else:
+                spans.append((start, end))
+
+    if not spans:
+        return opinion_text[:max_chars]
+    return "\n...\n".join(opinion_text[start:end] for start, end in spans)[:max_chars]
+
+def pack_contexts(contexts: List[CitationContext], max_chars: int = 60000, max_opinions: int = 10) -> List[List[CitationContext]]:
+    packs, current, size = [], [], 0
+    for context in contexts:
+        if current and (size + len(context[3]) > max_chars or len(current) >= max_opinions):
+            packs.append(current)
+            current, size = [], 0
+        current.append(context)
+        size += len(context[3])
+    if current:
+        packs.append(current)
+    return packs
+
+def build_batch_prompt(main_case_name: str, contexts: List[CitationContext]) -> str:
+    # Attribute values are escaped so a quote in a case name cannot end the attribute early
+    passages = "\n\n".join(
+        f"""<citing_opinion citing_id="{html.escape(citing_id, quote=True)}" name="{html.escape(citing_case_name, quote=True)}" date_filed="{html.escape(date_filed, quote=True)}">
+{context}
+</citing_opinion>"""
+        for citing_id, citing_case_name, date_filed, context in contexts
+    )
+    return f"""Analyze how each of the following citing opinions treats the case "{main_case_name}".
+    Each citing opinion is given as excerpts around its citations of "{main_case_name}".
+
+    Return exactly one entry in citing_cases per citing opinion, and copy its citing_id unchanged.
+    Use these labels and colors:
+
+    1. "followed" (Green): The citing case adhered to the cited case as a precedent.
+    2. "distinguished" (Blue): The citing case identified differences between the current case and the cited case, limiting its precedential value.
+    3. "partially overruled" (Yellow): The citing case overturned certain aspects of the cited case while maintaining others.
+    4. "overruled" (Red): The citing case completely overturns the cited case, negating its precedential authority.
+    5. "rejected" (Gray): The citing case refuses to accept the cited case as a precedent.
+    6. "declined to follow" (Orange): The citing case chooses not to adopt the reasoning or decision of the cited case as precedent.
+    7. "mentioned" (Purple): The citing case references the cited case without adopting or rejecting it as a precedent.
+
+    Choose the most appropriate label based on the opinion's language and context.
+    Provide a short reasoning for each classification, with quotes from the excerpts that support your choice.
+
+    Citing Opinions:
+    {passages}
+    """
+
+def build_request_body(main_case_name: str, contexts: List[CitationContext], model: str = "gpt-4o") -> Dict[str, Any]:
+    return {
+        "model": model,
+        "temperature": 0,
+        "max_tokens": 10000,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": build_batch_prompt(main_case_name, contexts)},
+        ],
+        "tools": [openai.pydantic_function_tool(BatchCitationAnalysis)],
+        "tool_choice": {"type": "function", "function": {"name": BatchCitationAnalysis.__name__}},
+    }
+
+def split_analysis(analysis: BatchCitationAnalysis, contexts: List[CitationContext]) -> Dict[str, Dict[str, Any]]:
+    # Merge the packed answer back into one result per citing opinion, in the streamlit result format
+    date_by_id = {citing_id: date_filed for citing_id, _, date_filed, _ in contexts}
+    results = {}
+    for citing_case in analysis.citing_cases:
+        if citing_case.citing_id not in date_by_id:
+            logging.warning(f"Ignoring analysis for unknown citing id: {citing_case.citing_id}")
+            continue
+        result = results.setdefault(citing_case.citing_id, {
+            "cited_case": analysis.cited_case.model_dump(),
+            "citing_cases": [],
+            "date_filed": date_by_id[citing_case.citing_id],
+        })
+        result["citing_cases"].append(citing_case.model_dump(mode="json"))
+
+    missing = set(date_by_id) - set(results)
+    if missing:
+        logging.warning(f"No analysis returned for citing ids: {', '.join(sorted(missing))}")
+    return results
+
+def process_opinion_pack(main_case_name: str, contexts: List[CitationContext], client: OpenAI, model: str = "gpt-4o") -> Dict[str, Dict[str, Any]]:
+    try:
+        completion = client.beta.chat.completions.parse(**build_request_body(main_case_name, contexts, model))
+        analysis = completion.choices[0].message.tool_calls[0].function.parsed_arguments
+        return split_analysis(analysis, contexts)
+    except Exception as e:
+        logging.error(f"Error processing batch of {len(contexts)} citing opinions: {str(e)}")
+        return {}
+
+def write_batch_file(requests: Dict[str, Dict[str, Any]], filename: str) -> None:
+    with open(filename, 'w', encoding='utf-8') as f:
+        for custom_id, body in requests.items():
+            f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}) + "\n")
+
+def submit_batch(client: OpenAI, filename: str) -> str:
+    with open(filename, 'rb') as f:
+        batch_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+    logging.info(f"Submitted batch {batch.id} from {filename}")
+    return batch.id
+
+def wait_for_batch(client: OpenAI, batch_id: str, poll_interval: float = 60, timeout: Optional[float] = None):
+    started = time.time()
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in ("completed", "failed", "expired", "cancelled"):
+            logging.info(f"Batch {batch_id} finished with status: {batch.status}")
+            return batch
+        if timeout is not None and time.time() - started > timeout:
+            raise TimeoutError(f"Batch {batch_id} still {batch.status} after {timeout} seconds")
+        logging.info(f"Batch {batch_id} is {batch.status}. Checking again in {poll_interval} seconds...")
+        time.sleep(poll_interval)
+
+def read_batch_output(client: OpenAI, batch) -> Dict[str, BatchCitationAnalysis]:
+    analyses = {}
+    if not batch.output_file_id:
+        return analyses
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get('response') or {}
+        if record.get('error') or response.get('status_code') != 200:
+            logging.error(f"Batch request {record.get('custom_id')} failed: {record.get('error') or response.get('status_code')}")
+            continue
+        try:
+            tool_call = response['body']['choices'][0]['message']['tool_calls'][0]
+            analyses[record['custom_id']] = BatchCitationAnalysis.model_validate_json(tool_call['function']['arguments'])
+        except Exception as e:
+            logging.error(f"Could not parse batch response {record.get('custom_id')}: {str(e)}")
+    return analyses
+
+def collect_contexts(main_case_name: str, citing_opinions: List[Dict[str, Any]], headers: Dict[str, str],
+                     window: int = 1500, max_chars: int = 6000, fetcher: Optional[BatchFetcher] = None,
+                     citations: Optional[List[str]] = None) -> List[CitationContext]:
+    fetcher = fetcher or BatchFetcher(headers)
+    fetcher.prefetch('opinions', [opinion['opinions'][0]['id'] for opinion in citing_opinions
+                                  if opinion.get('opinions') and opinion['opinions'][0].get('id') and not opinion.get('passages')])
+    contexts = []
+    for opinion in citing_opinions:
+        citing_id = citing_opinion_id(opinion)
+        citing_case_name = opinion.get('caseName') or opinion.get('caseNameFull') or 'Unknown Case Name'
+        content = get_opinion_text(opinion, headers, fetcher)
+        if citing_id is None or not content:
+            logging.warning(f"No content available for citing opinion: {citing_case_name}")
+            continue
+        context = extract_citation_context(content, main_case_name, citations, window, max_chars)
+        contexts.append((citing_id, citing_case_name, opinion.get('dateFiled') or 'Unknown Date', context))
+    return contexts
+
+def prepare_opinion(opinion_id: str, headers: Dict[str, str], fetcher: BatchFetcher, max_chars: int = 60000,
+                    max_opinions: int = 10, limit: Optional[int] = None,
+                    index=None) -> Tuple[str, List[CitationContext], List[List[CitationContext]]]:
+    cluster = get_cluster(opinion_id, headers, fetcher) or {}
+    main_case_name = cluster.get('case_name') or cluster.get('case_name_full') or "Unknown Case Name"
+    logging.info(f"Main Case Name for opinion {opinion_id}: {main_case_name}")
+
+    # Overnight runs cover every citing opinion unless a limit is given
+    contexts = collect_contexts(main_case_name, get_citing_opinions(opinion_id, headers, index, limit), headers,
+                                fetcher=fetcher, citations=cluster_citations(cluster))
+    packs = pack_contexts(contexts, max_chars, max_opinions)
+    logging.info(f"Packed {len(contexts)} citing opinions for opinion {opinion_id} into {len(packs)} requests")
+    return main_case_name, contexts, packs
+
+def process_opinions_offline(opinion_ids: List[str], headers: Dict[str, str], client: OpenAI, use_batch_api: bool = False,
+                             model: str = "gpt-4o", max_chars: int = 60000, max_opinions: int = 10,
+                             poll_interval: float = 60, batch_dir: str = ".", limit: Optional[int] = None,
+                             index=None) -> Dict[str, Tuple[str, List[Dict[str, Any]]]]:
+    opinion_ids = list(dict.fromkeys(str(opinion_id) for opinion_id in opinion_ids))
+    fetcher = BatchFetcher(headers)
+    fetcher.prefetch('clusters', opinion_ids)
+    prepared = {
+        opinion_id: prepare_opinion(opinion_id, headers, fetcher, max_chars, max_opinions, limit, index)
+        for opinion_id in opinion_ids
+    }
+
+    by_citing_id = {opinion_id: {} for opinion_id in opinion_ids}
+    if use_batch_api:
+        # Every pack of every opinion ID goes into one batch, so the run waits out a single completion window
+        requests = {
+            f"{opinion_id}-{i}": build_request_body(main_case_name, pack, model)
+            for opinion_id, (main_case_name, _, packs) in prepared.items()
+            for i, pack in enumerate(packs)
+        }
+        if requests:
+            filename = os.path.join(batch_dir, f"batch_requests_{opinion_ids[0]}.jsonl")
+            write_batch_file(requests, filename)
+            batch = wait_for_batch(client, submit_batch(client, filename), poll_interval)
+            analyses = read_batch_output(client, batch)
+            for opinion_id, (_, _, packs) in prepared.items():
+                for i, pack in enumerate(packs):
+                    analysis = analyses.get(f"{opinion_id}-{i}")
+                    if analysis:
+                        by_citing_id[opinion_id].update(split_analysis(analysis, pack))
+    else:
+        for opinion_id, (main_case_name, _, packs) in prepared.items():
+            for pack in packs:
+                by_citing_id[opinion_id].update(process_opinion_pack(main_case_name, pack, client, model))
+
+    return {
+        opinion_id: (main_case_name, [by_citing_id[opinion_id][citing_id] for citing_id, _, _, _ in contexts
+                                      if citing_id in by_citing_id[opinion_id]])
+        for opinion_id, (main_case_name, contexts, _) in prepared.items()
+    }
+
+def process_opinion_offline(opinion_id: str, headers: Dict[str, str], client: OpenAI, use_batch_api: bool = False,
+                            model: str = "gpt-4o", max_chars: int = 60000, max_opinions: int = 10,
+                            poll_interval: float = 60, batch_dir: str = ".", limit: Optional[int] = None,
+                            index=None) -> Tuple[str, List[Dict[str, Any]]]:
+    return process_opinions_offline([opinion_id], headers, client, use_batch_api, model, max_chars, max_opinions,
+                                    poll_interval, batch_dir, limit, index)[str(opinion_id)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Opinion Citation Analyzer with packed prompts")
+    parser.add_argument('opinion_ids', nargs='+')
+    parser.add_argument('--batch-api', action='store_true', help="Submit packed requests through the provider batch API")
+    parser.add_argument('--base-url', default=os.getenv('OPENAI_BASE_URL'), help="OpenAI-compatible endpoint, e.g. a local fake")
+    parser.add_argument('--model', default="gpt-4o")
+    parser.add_argument('--max-opinions', type=int, default=10, help="Citing opinions packed into one request")
+    parser.add_argument('--limit', type=int, help="Analyze at most this many citing opinions per opinion ID")
+    parser.add_argument('--index', help="Path to a local citation index database built with citator_index.py")
+    parser.add_argument('--poll-interval', type=float, default=60)
+    args = parser.parse_args()
+
+    headers = {
+        'Authorization': f"Token {os.getenv('AUTH_TOKEN', '')}"
+    }
+    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=args.base_url)
+
+    processed = process_opinions_offline(args.opinion_ids, headers, client, args.batch_api, args.model,
+                                         max_opinions=args.max_opinions, poll_interval=args.poll_interval, limit=args.limit,
+                                         index=CitationIndex(args.index) if args.index else None)
+    for opinion_id, (main_case_name, results) in processed.items():
+        output_filename = f'processed_opinions_{opinion_id}.json'
+        save_results_to_file(main_case_name, results, output_filename)
+        print(f"Saved {len(results)} results for {main_case_name} to: {output_filename}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import csv
+import time
+import json
+import os
+import hashlib
+import sqlite3
+import threading
+import argparse
+import concurrent.futures
+import logging
+from types import SimpleNamespace
+from typing import List, Dict, Any, Tuple, Optional
+import google.generativeai as genai
+
+from citator import Label, BASE_URL, make_request, get_case_name, opinion_content, process_single_opinion
+
+EVAL_DB = os.getenv('CITATOR_EVAL_DB', "citator_eval.db")
+
+LABELS = [label.value for label in Label]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    text TEXT NOT NULL,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    latency REAL
+);
+CREATE TABLE IF NOT EXISTS case_names (
+    cluster_id TEXT PRIMARY KEY,
+    case_name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS opinion_texts (
+    opinion_id TEXT PRIMARY KEY,
+    text TEXT NOT NULL
+);
+"""
+
+DEFAULT_CONFIGS = [
+    {"name": "gemini-1.5-pro", "model": "gemini-1.5-pro-latest", "input_price": 1.25, "output_price": 5.00},
+]
+
+class Recordings:
+    """Recorded LLM responses, case names and opinion texts for replaying an evaluation offline."""
+
+    def __init__(self, path: str = EVAL_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def _get(self, query: str, params: Tuple) -> Optional[sqlite3.Row]:
+        with self.lock:
+            return self.conn.execute(query, params).fetchone()
+
+    def _put(self, query: str, params: Tuple) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(query, params)
+
+    def get_response(self, key: str) -> Optional[sqlite3.Row]:
+        return self._get("SELECT * FROM responses WHERE key = ?", (key,))
+
+    def put_response(self, key: str, model: str, text: str, input_tokens: int, output_tokens: int, latency: float) -> None:
+        self._put("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", (key, model, text, input_tokens, output_tokens, latency))
+
+    def case_name(self, cluster_id: str, headers: Dict[str, str]) -> str:
+        row = self._get("SELECT case_name FROM case_names WHERE cluster_id = ?", (str(cluster_id),))
+        if row:
+            return row['case_name']
+        case_name = get_case_name(cluster_id, headers)
+        if case_name != "Unknown Case Name":
+            self._put("INSERT OR REPLACE INTO case_names VALUES (?, ?)", (str(cluster_id), case_name))
+        return case_name
+
+    def opinion_text(self, opinion_id: str, headers: Dict[str, str]) -> Optional[str]:
+        row = self._get("SELECT text FROM opinion_texts WHERE opinion_id = ?", (str(opinion_id),))
+        if row:
+            return row['text']
+        opinion_data = make_request(f"{BASE_URL}/opinions/{opinion_id}/", headers)
+        text = opinion_content(opinion_data) if opinion_data else None
+        if text:
+            self._put("INSERT OR REPLACE INTO opinion_texts VALUES (?, ?)", (str(opinion_id), text))
+        return text
+
+class RecordingModel:
+    """Stands in for a GenerativeModel, replaying recorded responses and counting tokens and latency."""
+
+    def __init__(self, model_name: str, recordings: Recordings, replay_only: bool = False):
+        self.model_name = model_name
+        self.recordings = recordings
+        self.replay_only = replay_only
+        self.model = None if replay_only else genai.GenerativeModel(model_name)
+        self.lock = threading.Lock()
+        # process_single_opinion swallows exceptions, so a missing recording or a failed call is flagged per thread instead
+        self.local = threading.local()
+        self.calls = 0
+        self.errors = 0
+        self.replayed = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.model_latency = 0.0
+
+    def generate_content(self, prompt: str, generation_config=None):
+        key = hashlib.sha256(f"{self.model_name}\n{prompt}".encode('utf-8')).hexdigest()
+        row = self.recordings.get_response(key)
+        if row:
+            text, input_tokens, output_tokens, latency, replayed = row['text'], row['input_tokens'], row['output_tokens'], row['latency'], 1
+        elif self.replay_only:
+            self.local.missing = True
+            raise LookupError(f"No recorded {self.model_name} response for this prompt")
+        else:
+            started = time.time()
+            try:
+                response = self.model.generate_content(prompt, generation_config=generation_config)
+            except Exception:
+                self.local.error = True
+                with self.lock:
+                    self.errors += 1
+                raise
+            latency = time.time() - started
+            text = response.text
+            input_tokens = response.usage_metadata.prompt_token_count
+            output_tokens = response.usage_metadata.candidates_token_count
+            replayed = 0
+            self.recordings.put_response(key, self.model_name, text, input_tokens, output_tokens, latency)
+
+        with self.lock:
+            self.calls += 1
+            self.replayed += replayed
+            self.input_tokens += input_tokens or 0
+            self.output_tokens += output_tokens or 0
+            self.model_latency += latency or 0
+        return SimpleNamespace(text=text)
+
+def load_labelled_pairs(filename: str) -> List[Dict[str, str]]:
+    # Rows need cited_id, citing_opinion_id and label (citing_case_name is optional); CSV with a header row or JSON lines
+    with open(filename, 'r', encoding='utf-8') as f:
+        if filename.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    return [
+        {
+            "cited_id": str(row['cited_id']),
+            "citing_opinion_id": str(row['citing_opinion_id']),
+            "citing_case_name": row.get('citing_case_name') or "Unknown Case Name",
+            "label": row['label'].strip().lower(),
+        }
+        for row in rows
+    ]
+
+def normalize_label(label: Any) -> str:
+    label = str(label or "").strip().lower()
+    return label if label in LABELS else "other"
+
+def confusion_matrix(pairs: List[Tuple[str, str]]) -> Dict[str, Dict[str, int]]:
+    labels = LABELS + ["other"]
+    matrix = {expected: {predicted: 0 for predicted in labels} for expected in labels}
+    for expected, predicted in pairs:
+        matrix[normalize_label(expected)][normalize_label(predicted)] += 1
+    return matrix
+
+def evaluate_example(example: Dict[str, str], config: Dict[str, Any], model: RecordingModel,
+                     recordings: Recordings, headers: Dict[str, str]) -> Tuple[str, Optional[str]]:
+    # A predicted label of None marks an example that could not be scored
+    main_case_name = recordings.case_name(example['cited_id'], headers)
+    text = recordings.opinion_text(example['citing_opinion_id'], headers)
+    if not text:
+        logging.warning(f"No content available for citing opinion: {example['citing_opinion_id']}")
+        return example['label'], None
+
+    model.local.missing = False
+    model.local.error = False
+    result = process_single_opinion(main_case_name, example['citing_case_name'], "Unknown Date", text, model, config.get('max_chars'))
+    if model.local.missing:
+        logging.warning(f"No recorded response for citing opinion {example['citing_opinion_id']}, leaving it out of the score")
+        return example['label'], None
+    if model.local.error:
+        logging.warning(f"Model call failed for citing opinion {example['citing_opinion_id']}, leaving it out of the score")
+        return example['label'], None
+    return example['label'], (result or {}).get('label', "other")
+
+def evaluate_config(examples: List[Dict[str, str]], config: Dict[str, Any], recordings: Recordings,
+                    headers: Dict[str, str], replay_only: bool = False, max_workers: int = 8) -> Dict[str, Any]:
+    model = RecordingModel(config['model'], recordings, replay_only)
+    started = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pairs = list(executor.map(lambda example: evaluate_example(example, config, model, recordings, headers), examples))
+    wall_time = time.time() - started
+
+    scored = [(expected, predicted) for expected, predicted in pairs if predicted is not None]
+    matrix = confusion_matrix(scored)
+    correct = sum(matrix[label][label] for label in LABELS)
+    cost = (model.input_tokens * config.get('input_price', 0) + model.output_tokens * config.get('output_price', 0)) / 1_000_000
+    return {
+        "name": config.get('name', config['model']),
+        "config": config,
+        "examples": len(examples),
+        "scored": len(scored),
+        "missing": len(pairs) - len(scored) - model.errors,
+        "errors": model.errors,
+        "accuracy": correct / len(scored) if scored else None,
+        "confusion_matrix": matrix,
+        "llm_calls": model.calls,
+        "replayed_calls": model.replayed,
+        "input_tokens": model.input_tokens,
+        "output_tokens": model.output_tokens,
+        "cost": cost,
+        "wall_time": wall_time,
+        "model_latency": model.model_latency,
+    }
+
+def print_report(report: Dict[str, Any]) -> None:
+    accuracy = f"{report['accuracy']:.1%}" if report['accuracy'] is not None else "n/a"
+    print(f"\n{report['name']}: accuracy {accuracy} on {report['scored']} of {report['examples']} examples")
+    if report['missing']:
+        print(f"   Missing: {report['missing']} examples had no recorded response or opinion text and were not scored")
+    if report['errors']:
+        print(f"   Errors: {report['errors']} model calls failed and were not scored; re-run to retry them")
+    print(f"   Tokens: {report['input_tokens']} in / {report['output_tokens']} out, cost ${report['cost']:.4f}")
+    print(f"   Wall time: {report['wall_time']:.1f}s, recorded model latency: {report['model_latency']:.1f}s "
+          f"({report['replayed_calls']} of {report['llm_calls']} calls replayed)")
+
+    matrix = report['confusion_matrix']
+    labels = [label for label in matrix if sum(matrix[label].values()) or sum(row[label] for row in matrix.values())]
+    if not labels:
+        return
+    header = "expected \\ predicted"
+    width = max(len(label) for label in labels) + 2
+    first = max(width, len(header) + 2)
+    print("   " + header.ljust(first) + "".join(label.rjust(width) for label in labels))
+    for expected in labels:
+        print("   " + expected.ljust(first) + "".join(str(matrix[expected][predicted]).rjust(width) for predicted in labels))
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate pipeline configurations against human-labelled citations")
+    parser.add_argument('labels', help="CSV or JSON lines file of cited_id, citing_opinion_id, label")
+    parser.add_argument('--configs', help="JSON list of configurations: name, model, max_chars, input_price, output_price (USD per 1M tokens)")
+    parser.add_argument('--db', default=EVAL_DB, help="Path to the SQLite recordings database")
+    parser.add_argument('--replay-only', action='store_true', help="Never call the model; examples without a recorded response are reported as missing and not scored")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--output', default="evaluation_report.json")
+    args = parser.parse_args()
+
+    configs = DEFAULT_CONFIGS
+    if args.configs:
+        with open(args.configs, 'r', encoding='utf-8') as f:
+            configs = json.load(f)
+
+    headers = {
+        'Authorization': f"Token {os.getenv('AUTH_TOKEN', '')}"
+    }
+    if not args.replay_only:
+        genai.configure(api_key=os.getenv('GENAI_API_KEY'))
+
+    examples = load_labelled_pairs(args.labels)
+    recordings = Recordings(args.db)
+    reports = [evaluate_config(examples, config, recordings, headers, args.replay_only, args.workers) for config in configs]
+    for report in reports:
+        print_report(report)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(reports, f, indent=2)
+    print(f"\nFull report saved to: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import os
+import re
+import argparse
+import json
+import uuid
+import logging
+from enum import Enum
+from typing import List, Dict, Any, Optional
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+from citator import LABEL_COLORS
+
+# Label and Color are dictionary-encoded: a handful of distinct values repeated across millions of edges
+TREATMENT_SCHEMA = pa.schema([
+    ("cited_id", pa.string()),
+    ("cited_case_name", pa.string()),
+    ("cited_case_citation", pa.string()),
+    ("citing_case_name", pa.string()),
+    ("citing_case_citation", pa.string()),
+    ("date_filed", pa.string()),
+    ("year", pa.int16()),
+    ("label", pa.dictionary(pa.int8(), pa.string())),
+    ("color", pa.dictionary(pa.int8(), pa.string())),
+    ("reasoning", pa.string()),
+])
+
+FORMATS = {
+    "parquet": ("parquet", ds.ParquetFileFormat(), {"compression": "zstd"}),
+    "arrow": ("arrow", ds.IpcFileFormat(), {"compression": "zstd"}),
+}
+
+def _value(value: Any) -> Optional[str]:
+    if isinstance(value, Enum):
+        value = value.value
+    if value is None or value == "":
+        return None
+    return str(value)
+
+def _year(date_filed: Optional[str]) -> Optional[int]:
+    match = re.match(r"(\d{4})", date_filed or "")
+    return int(match.group(1)) if match else None
+
+def flatten_results(opinion_id: str, main_case_name: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    rows = []
+    for result in results:
+        # Results from the streamlit app nest the citing cases under the cited case
+        if 'citing_cases' in result:
+            cited_case = result.get('cited_case') or {}
+            treatments = [
+                {
+                    "cited_case_name": cited_case.get('name'),
+                    "cited_case_citation": cited_case.get('citation'),
+                    "citing_case_name": citing_case.get('name'),
+                    "citing_case_citation": citing_case.get('citation'),
+                    "label": citing_case.get('label'),
+                    "color": citing_case.get('color'),
+                    "reasoning": citing_case.get('reasoning'),
+                }
+                for citing_case in result['citing_cases']
+            ]
+        else:
+            treatments = [result]
+
+        for treatment in treatments:
+            label = _value(treatment.get('label'))
+            label = label.lower() if label else None
+            date_filed = _value(result.get('date_filed'))
+            rows.append({
+                "cited_id": str(opinion_id),
+                "cited_case_name": _value(treatment.get('cited_case_name')) or main_case_name,
+                "cited_case_citation": _value(treatment.get('cited_case_citation')),
+                "citing_case_name": _value(treatment.get('citing_case_name')),
+                "citing_case_citation": _value(treatment.get('citing_case_citation')),
+                "date_filed": date_filed,
+                "year": _year(date_filed),
+                "label": label,
+                "color": _value(treatment.get('color')) or LABEL_COLORS.get(label),
+                "reasoning": _value(treatment.get('reasoning')),
+            })
+    return rows
+
+def results_to_table(opinion_id: str, main_case_name: str, results: List[Dict[str, Any]]) -> pa.Table:
+    return pa.Table.from_pylist(flatten_results(opinion_id, main_case_name, results), schema=TREATMENT_SCHEMA)
+
+def _partitioning(partition_by: str) -> ds.Partitioning:
+    if partition_by not in ("cited_id", "year"):
+        raise ValueError(f"Cannot partition treatments by {partition_by!r}, use 'cited_id' or 'year'")
+    return ds.partitioning(pa.schema([TREATMENT_SCHEMA.field(partition_by)]), flavor="hive")
+
+def append_results(opinion_id: str, main_case_name: str, results: List[Dict[str, Any]], root: str,
+                   partition_by: str = "cited_id", format: str = "parquet") -> int:
+    table = results_to_table(opinion_id, main_case_name, results)
+    if table.num_rows == 0:
+        return 0
+
+    extension, file_format, write_options = FORMATS[format]
+    # A unique basename per call lets every run append new files next to the existing ones
+    ds.write_dataset(
+        table,
+        root,
+        format=file_format,
+        file_options=file_format.make_write_options(**write_options),
+        partitioning=_partitioning(partition_by),
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.{extension}",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+    logging.info(f"Appended {table.num_rows} treatments for opinion {opinion_id} to {root}")
+    return table.num_rows
+
+def open_treatments(root: str, partition_by: str = "cited_id", format: str = "parquet") -> ds.Dataset:
+    # Memory-mapped reads keep large scans off the Python heap
+    return ds.dataset(
+        os.path.abspath(root),
+        format=FORMATS[format][1],
+        partitioning=_partitioning(partition_by),
+        filesystem=pafs.LocalFileSystem(use_mmap=True),
+    )
+
+def read_treatments(root: str, partition_by: str = "cited_id", format: str = "parquet",
+                    cited_id: Optional[str] = None, columns: Optional[List[str]] = None) -> pa.Table:
+    dataset = open_treatments(root, partition_by, format)
+    row_filter = pc.field("cited_id") == str(cited_id) if cited_id is not None else None
+    # Each appended file carries its own Label/Color dictionary
+    return dataset.to_table(columns=columns, filter=row_filter).unify_dictionaries()
+
+def treatment_counts(root: str, partition_by: str = "cited_id", format: str = "parquet") -> pa.Table:
+    table = read_treatments(root, partition_by, format, columns=["cited_id", "label"])
+    return table.group_by(["cited_id", "label"]).aggregate([([], "count_all")])
+
+def export_json_file(filename: str, root: str, partition_by: str = "cited_id", format: str = "parquet") -> int:
+    match = re.search(r"processed_opinions_(\w+)\.json$", filename)
+    if not match:
+        raise ValueError(f"Cannot determine the opinion ID from {filename}")
+    with open(filename, 'r', encoding='utf-8') as f:
+        output = json.load(f)
+    return append_results(match.group(1), output.get('main_case_name', "Unknown Case Name"),
+                          output.get('citing_opinions', []), root, partition_by, format)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export treatment results to a columnar dataset")
+    parser.add_argument('root', help="Dataset directory to append to")
+    parser.add_argument('filenames', nargs='+', help="processed_opinions_<id>.json files")
+    parser.add_argument('--partition-by', choices=["cited_id", "year"], default="cited_id")
+    parser.add_argument('--format', choices=sorted(FORMATS), default="parquet")
+    args = parser.parse_args()
+
+    total = 0
+    for filename in args.filenames:
+        total += export_json_file(filename, args.root, args.partition_by, args.format)
+    print(f"Exported {total} treatments to: {args.root}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import re
+import os
+import sys
+import html
+import json
+import sqlite3
+import logging
+from typing import List, Dict, Any, Tuple, Optional
+
+from citator import BASE_URL, BatchFetcher, make_request, opinion_content, is_generic_party
+
+INDEX_DB = os.getenv('CITATOR_INDEX_DB', "citator_index.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS opinions (
+    opinion_id TEXT PRIMARY KEY,
+    cluster_id TEXT,
+    case_name TEXT,
+    date_filed TEXT,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS citations (
+    authority TEXT NOT NULL,
+    opinion_id TEXT NOT NULL,
+    paragraph INTEGER NOT NULL,
+    paragraph_start INTEGER NOT NULL,
+    paragraph_end INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS citations_authority ON citations (authority, opinion_id);
+CREATE INDEX IF NOT EXISTS citations_opinion ON citations (opinion_id);
+CREATE TABLE IF NOT EXISTS clusters (
+    cluster_id TEXT PRIMARY KEY,
+    authorities TEXT NOT NULL
+);
+"""
+
+REPORTERS = [
+    r"U\.\s?S\.", r"S\.\s?Ct\.", r"L\.\s?Ed\.(?:\s?2d)?",
+    r"F\.\s?Supp\.(?:\s?[23]d)?", r"F\.(?:\s?(?:2d|3d|4th))?", r"F\.\s?App'x", r"B\.\s?R\.",
+    r"A\.(?:\s?[23]d)?", r"P\.(?:\s?[23]d)?", r"N\.\s?E\.(?:\s?[23]d)?", r"N\.\s?W\.(?:\s?2d)?",
+    r"S\.\s?E\.(?:\s?2d)?", r"S\.\s?W\.(?:\s?[23]d)?", r"So\.(?:\s?[23]d)?",
+    r"Cal\.\s?Rptr\.(?:\s?[23]d)?", r"N\.\s?Y\.\s?S\.(?:\s?[23]d)?",
+]
+
+REPORTER_CITATION = re.compile(r"\b(\d{1,4})\s+(" + "|".join(REPORTERS) + r")\s+(\d{1,5})\b")
+
+PARTY = r"[A-Z][\w.'&-]*(?:\s+(?:of|the|and|&|[A-Z][\w.'&-]*)){0,5}?"
+CASE_NAME = re.compile(r"\b(" + PARTY + r")\s+v\.\s+(" + PARTY + r")(?=[,;:.]|\s+\(|\s+\d|\s*$)", re.MULTILINE)
+
+SIGNALS = re.compile(r"^(?:(?:See|Also|Cf\.|But|Accord|E\.g\.,?|In|Compare|With|Under|And|The|As)\s+)+", re.IGNORECASE)
+
+def normalize_citation(volume: Any, reporter: str, page: Any) -> str:
+    reporter = re.sub(r"\s+", "", reporter)
+    return f"{volume} {reporter} {page}"
+
+def normalize_case_name(case_name: str) -> str:
+    case_name = SIGNALS.sub("", case_name.strip())
+    return "name:" + re.sub(r"\s+", " ", case_name).lower()
+
+def strip_markup(text: str) -> str:
+    if "<" not in text:
+        return text
+    text = re.sub(r"(?i)</?(?:p|div|br|blockquote|h\d)[^>]*>", "\n\n", text)
+    return html.unescape(re.sub(r"<[^>]+>", "", text))
+
+def paragraphs(text: str) -> List[Tuple[int, int]]:
+    spans, start = [], 0
+    for match in re.finditer(r"\n\s*\n", text):
+        if text[start:match.start()].strip():
+            spans.append((start, match.start()))
+        start = match.end()
+    if text[start:].strip():
+        spans.append((start, len(text)))
+    return spans
+
+def extract_citations(text: str) -> List[Tuple[str, int, int]]:
+    citations = [
+        (normalize_citation(*match.groups()), match.start(), match.end())
+        for match in REPORTER_CITATION.finditer(text)
+    ]
+    for match in CASE_NAME.finditer(text):
+        citations.append((normalize_case_name(match.group(0)), match.start(), match.end()))
+    return citations
+
+def opinion_cluster_id(opinion_data: Dict[str, Any]) -> Optional[str]:
+    cluster = opinion_data.get('cluster')
+    if opinion_data.get('cluster_id') is not None:
+        return str(opinion_data['cluster_id'])
+    if isinstance(cluster, dict) and cluster.get('id') is not None:
+        return str(cluster['id'])
+    if isinstance(cluster, str):
+        return cluster.rstrip('/').rsplit('/', 1)[-1]
+    return None
+
+def cluster_authorities(cluster_data: Dict[str, Any]) -> List[str]:
+    authorities = [
+        normalize_citation(citation['volume'], citation['reporter'], citation['page'])
+        for citation in cluster_data.get('citations', [])
+        if citation.get('volume') and citation.get('reporter') and citation.get('page')
+    ]
+    # Names with a government party ("State v. Smith") are shared by many unrelated clusters
+    case_name = cluster_data.get('case_name') or cluster_data.get('case_name_full')
+    if case_name and " v. " in case_name and not any(is_generic_party(party) for party in case_name.split(" v. ", 1)):
+        authorities.append(normalize_case_name(case_name))
+    return authorities
+
+class CitationIndex:
+    """Inverted index from cited authorities to the paragraphs of local opinions that cite them.
+
+    Authorities are normalized reporter citations ("163 U.S. 537") or case
+    names ("name:plessy v. ferguson"). Offsets point into the stored opinion
+    text, which is the markup-free version of what was ingested.
+    """
+
+    def __init__(self, path: str = INDEX_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def add_opinion(self, opinion_id: str, text: str, case_name: Optional[str] = None,
+                    date_filed: Optional[str] = None, cluster_id: Optional[str] = None) -> int:
+        opinion_id = str(opinion_id)
+        text = strip_markup(text)
+        rows = []
+        spans = paragraphs(text)
+        for authority, start, end in extract_citations(text):
+            for paragraph, (paragraph_start, paragraph_end) in enumerate(spans):
+                if paragraph_start <= start < paragraph_end:
+                    rows.append((authority, opinion_id, paragraph, paragraph_start, paragraph_end, start, end))
+                    break
+
+        with self.conn:
+            self.conn.execute("DELETE FROM citations WHERE opinion_id = ?", (opinion_id,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO opinions (opinion_id, cluster_id, case_name, date_filed, text) VALUES (?, ?, ?, ?, ?)",
+                (opinion_id, str(cluster_id) if cluster_id else None, case_name, date_filed, text)
+            )
+            self.conn.executemany("INSERT INTO citations VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def add_opinion_data(self, opinion_data: Dict[str, Any], cluster_data: Optional[Dict[str, Any]] = None) -> int:
+        content = opinion_content(opinion_data)
+        if not opinion_data.get('id') or not content:
+            return 0
+        # Opinions carry no case name or filing date; those come from the cluster, which bulk exports may nest
+        if cluster_data is None and isinstance(opinion_data.get('cluster'), dict):
+            cluster_data = opinion_data['cluster']
+        cluster_data = cluster_data or {}
+        case_name = opinion_data.get('case_name') or cluster_data.get('case_name') or cluster_data.get('case_name_full')
+        date_filed = opinion_data.get('date_filed') or cluster_data.get('date_filed')
+        return self.add_opinion(opinion_data['id'], content, case_name, date_filed, opinion_cluster_id(opinion_data))
+
+    def lookup(self, authorities: List[str]) -> List[Dict[str, Any]]:
+        if not authorities:
+            return []
+        placeholders = ", ".join("?" for _ in authorities)
+        rows = self.conn.execute(
+            f"SELECT c.*, o.case_name, o.date_filed, o.cluster_id FROM citations c JOIN opinions o USING (opinion_id) "
+            f"WHERE c.authority IN ({placeholders}) ORDER BY c.opinion_id, c.start",
+            authorities
+        )
+        return [dict(row) for row in rows]
+
+    def passages(self, opinion_id: str, authorities: List[str]) -> List[str]:
+        row = self.conn.execute("SELECT text FROM opinions WHERE opinion_id = ?", (str(opinion_id),)).fetchone()
+        if row is None:
+            return []
+        placeholders = ", ".join("?" for _ in authorities)
+        spans = self.conn.execute(
+            f"SELECT DISTINCT paragraph_start, paragraph_end FROM citations "
+            f"WHERE opinion_id = ? AND authority IN ({placeholders}) ORDER BY paragraph_start",
+            [str(opinion_id)] + list(authorities)
+        )
+        return [row['text'][start:end].strip() for start, end in spans]
+
+    def set_cluster_authorities(self, cluster_id: str, authorities: List[str]) -> None:
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO clusters VALUES (?, ?)", (str(cluster_id), json.dumps(authorities)))
+
+    def get_cluster_authorities(self, cluster_id: str, headers: Dict[str, str]) -> List[str]:
+        row = self.conn.execute("SELECT authorities FROM clusters WHERE cluster_id = ?", (str(cluster_id),)).fetchone()
+        if row:
+            return json.loads(row['authorities'])
+
+        data = make_request(f"{BASE_URL}/clusters/{cluster_id}/", headers)
+        if not data:
+            return []
+        authorities = cluster_authorities(data)
+        self.set_cluster_authorities(cluster_id, authorities)
+        return authorities
+
+    def find_citing_opinions(self, cluster_id: str, headers: Dict[str, str]) -> List[Dict[str, Any]]:
+        authorities = self.get_cluster_authorities(cluster_id, headers)
+        has_citations = any(not authority.startswith("name:") for authority in authorities)
+        hits = self.lookup(authorities)
+        cited_paragraphs = {(hit['opinion_id'], hit['paragraph']) for hit in hits if not hit['authority'].startswith("name:")}
+        citing = {}
+        for hit in hits:
+            # An opinion never cites itself as a citing case
+            if hit['cluster_id'] == str(cluster_id):
+                continue
+            # A case name only counts next to one of the cluster's own reporter citations, when it has any
+            if hit['authority'].startswith("name:") and has_citations and (hit['opinion_id'], hit['paragraph']) not in cited_paragraphs:
+                continue
+            citing.setdefault(hit['opinion_id'], hit)
+
+        # Results mirror the shape of the hosted search results
+        return [
+            {
+                "caseName": hit['case_name'] or "Unknown Case Name",
+                "dateFiled": hit['date_filed'] or "Unknown Date",
+                "cluster_id": hit['cluster_id'],
+                "opinions": [{"id": opinion_id}],
+                "passages": self.passages(opinion_id, authorities),
+                "source": "local",
+            }
+            for opinion_id, hit in citing.items()
+        ]
+
+def ingest_opinions(index: CitationIndex, opinions: List[Dict[str, Any]], fetcher: Optional[BatchFetcher] = None) -> int:
+    # Opinions that arrive without a case name get theirs from the cluster, fetched together in one id__in request
+    cluster_ids = {}
+    if fetcher is not None:
+        for opinion_data in opinions:
+            cluster_id = opinion_cluster_id(opinion_data)
+            if cluster_id and not opinion_data.get('case_name') and not isinstance(opinion_data.get('cluster'), dict):
+                cluster_ids[id(opinion_data)] = cluster_id
+        fetcher.prefetch('clusters', sorted(set(cluster_ids.values())))
+
+    indexed = 0
+    for opinion_data in opinions:
+        cluster_id = cluster_ids.get(id(opinion_data))
+        indexed += index.add_opinion_data(opinion_data, fetcher.get('clusters', cluster_id) if cluster_id else None)
+    return indexed
+
+def ingest_directory(index: CitationIndex, path: str, headers: Optional[Dict[str, str]] = None, chunk_size: int = 100) -> int:
+    # Accepts CourtListener opinion JSON (as downloaded or bulk-exported) and plain <opinion_id>.txt files
+    fetcher = BatchFetcher(headers) if headers is not None else None
+    indexed, chunk = 0, []
+    for filename in sorted(os.listdir(path)):
+        filepath = os.path.join(path, filename)
+        opinion_id, extension = os.path.splitext(filename)
+        if extension == ".json":
+            with open(filepath, 'r', encoding='utf-8') as f:
+                chunk.append(json.load(f))
+            if len(chunk) >= chunk_size:
+                indexed += ingest_opinions(index, chunk, fetcher)
+                chunk = []
+        elif extension == ".txt":
+            with open(filepath, 'r', encoding='utf-8') as f:
+                indexed += index.add_opinion(opinion_id, f.read())
+    indexed += ingest_opinions(index, chunk, fetcher)
+    logging.info(f"Indexed {indexed} citations from {path}")
+    return indexed
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ("ingest", "lookup"):
+        print("Usage: python citator_index.py ingest DIRECTORY [...]")
+        print("       python citator_index.py lookup \"163 U.S. 537\"")
+        sys.exit(1)
+
+    index = CitationIndex()
+    if sys.argv[1] == "ingest":
+        headers = {
+            'Authorization': f"Token {os.getenv('AUTH_TOKEN', '')}"
+        }
+        for path in sys.argv[2:]:
+            ingest_directory(index, path, headers)
+    else:
+        authority = sys.argv[2]
+        match = REPORTER_CITATION.fullmatch(authority.strip())
+        authority = normalize_citation(*match.groups()) if match else normalize_case_name(authority)
+        for hit in index.lookup([authority]):
+            print(f"{hit['opinion_id']}\t{hit['case_name']}\tparagraph {hit['paragraph']}\t[{hit['start']}:{hit['end']}]")
+
+if __name__ == "__main__":
+    main()
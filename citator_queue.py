@@ -0,0 +1,273 @@
+import sqlite3
+import time
+import json
+import os
+import uuid
+import socket
+import argparse
+import concurrent.futures
+import logging
+from typing import List, Dict, Any, Tuple, Optional
+import google.generativeai as genai
+
+from citator import BatchFetcher, get_case_name, get_citing_opinions, citing_opinion_id, process_opinion_worker, save_results_to_file
+from citator_index import CitationIndex
+
+QUEUE_DB = os.getenv('CITATOR_QUEUE_DB', "citator_queue.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cited_id TEXT NOT NULL,
+    citing_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_token TEXT,
+    leased_by TEXT,
+    result TEXT,
+    last_error TEXT,
+    updated_at REAL NOT NULL,
+    UNIQUE (cited_id, citing_id)
+);
+CREATE INDEX IF NOT EXISTS jobs_available ON jobs (status, available_at);
+"""
+
+class JobQueue:
+    """Durable SQLite work queue of (cited id, citing opinion id) jobs.
+
+    A leased job is hidden from other workers until its visibility timeout
+    expires; a job that fails or times out `max_attempts` times is moved to
+    the 'dead' status instead of being retried again.
+    """
+
+    def __init__(self, path: str = QUEUE_DB, visibility_timeout: float = 600, max_attempts: int = 3, retry_delay: float = 30):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def enqueue(self, cited_id: str, citing_id: str, payload: Dict[str, Any]) -> bool:
+        now = time.time()
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO jobs (cited_id, citing_id, payload, available_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (str(cited_id), str(citing_id), json.dumps(payload), now, now)
+        )
+        return cursor.rowcount == 1
+
+    def lease(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Leases that ran out on their last attempt are dead-lettered rather than handed out again
+            self.conn.execute(
+                "UPDATE jobs SET status = 'dead', last_error = 'visibility timeout expired', lease_token = NULL, updated_at = ? "
+                "WHERE status = 'leased' AND available_at <= ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            row = self.conn.execute(
+                "SELECT * FROM jobs WHERE status IN ('pending', 'leased') AND available_at <= ? ORDER BY available_at, id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            token = uuid.uuid4().hex
+            self.conn.execute(
+                "UPDATE jobs SET status = 'leased', attempts = attempts + 1, available_at = ?, lease_token = ?, leased_by = ?, updated_at = ? WHERE id = ?",
+                (now + self.visibility_timeout, token, worker_id, now, row['id'])
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['attempts'] += 1
+        job['lease_token'] = token
+        return job
+
+    def ack(self, job: Dict[str, Any], result: Dict[str, Any]) -> bool:
+        cursor = self.conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, lease_token = NULL, last_error = NULL, updated_at = ? WHERE id = ? AND lease_token = ?",
+            (json.dumps(result), time.time(), job['id'], job['lease_token'])
+        )
+        if cursor.rowcount == 0:
+            logging.warning(f"Lease for job {job['id']} was lost before it could be acknowledged")
+        return cursor.rowcount == 1
+
+    def fail(self, job: Dict[str, Any], error: str) -> bool:
+        now = time.time()
+        if job['attempts'] >= self.max_attempts:
+            status, available_at = 'dead', now
+        else:
+            status, available_at = 'pending', now + self.retry_delay * (2 ** (job['attempts'] - 1))
+        cursor = self.conn.execute(
+            "UPDATE jobs SET status = ?, available_at = ?, last_error = ?, lease_token = NULL, updated_at = ? WHERE id = ? AND lease_token = ?",
+            (status, available_at, error, now, job['id'], job['lease_token'])
+        )
+        return cursor.rowcount == 1
+
+    def requeue_dead(self, cited_id: Optional[str] = None) -> int:
+        query = "UPDATE jobs SET status = 'pending', attempts = 0, available_at = ?, updated_at = ? WHERE status = 'dead'"
+        params: List[Any] = [time.time(), time.time()]
+        if cited_id is not None:
+            query += " AND cited_id = ?"
+            params.append(str(cited_id))
+        return self.conn.execute(query, params).rowcount
+
+    def counts(self, cited_id: Optional[str] = None) -> Dict[str, int]:
+        query = "SELECT status, COUNT(*) AS n FROM jobs"
+        params: List[Any] = []
+        if cited_id is not None:
+            query += " WHERE cited_id = ?"
+            params.append(str(cited_id))
+        query += " GROUP BY status"
+        return {row['status']: row['n'] for row in self.conn.execute(query, params)}
+
+    def results(self, cited_id: str) -> List[Dict[str, Any]]:
+        rows = self.conn.execute(
+            "SELECT result FROM jobs WHERE cited_id = ? AND status = 'done' ORDER BY id", (str(cited_id),)
+        )
+        return [json.loads(row['result']) for row in rows]
+
+    def main_case_name(self, cited_id: str) -> str:
+        row = self.conn.execute("SELECT payload FROM jobs WHERE cited_id = ? LIMIT 1", (str(cited_id),)).fetchone()
+        if row:
+            return json.loads(row['payload']).get('main_case_name', "Unknown Case Name")
+        return "Unknown Case Name"
+
+def enqueue_opinion(opinion_id: str, headers: Dict[str, str], queue: JobQueue, index=None, limit: Optional[int] = None,
+                    fetcher: Optional[BatchFetcher] = None) -> int:
+    main_case_name = get_case_name(opinion_id, headers, fetcher or BatchFetcher(headers))
+    logging.info(f"Main Case Name for opinion {opinion_id}: {main_case_name}")
+
+    # Crawls enqueue every page of the citing search unless a limit is given
+    citing_opinions = get_citing_opinions(opinion_id, headers, index, limit)
+    enqueued = 0
+    for opinion in citing_opinions:
+        citing_id = citing_opinion_id(opinion)
+        if citing_id is None:
+            logging.warning(f"Skipping citing opinion without an id: {opinion.get('caseName', 'Unknown Case Name')}")
+            continue
+        if queue.enqueue(opinion_id, citing_id, {"main_case_name": main_case_name, "opinion": opinion}):
+            enqueued += 1
+
+    logging.info(f"Enqueued {enqueued} of {len(citing_opinions)} citing opinions for opinion ID: {opinion_id}")
+    return enqueued
+
+def run_job(job: Dict[str, Any], headers: Dict[str, str], genai_model, fetcher: BatchFetcher) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    payload = job['payload']
+    try:
+        result = process_opinion_worker(payload['main_case_name'], payload['opinion'], headers, genai_model, fetcher)
+    except Exception as e:
+        logging.error(f"Job {job['id']} raised: {e}")
+        return None, str(e)
+    if result:
+        return result, None
+    return None, "no result returned for citing opinion"
+
+def run_worker(queue: JobQueue, headers: Dict[str, str], genai_model, worker_id: Optional[str] = None,
+               poll_interval: float = 5, exit_when_idle: bool = False, batch_size: int = 10) -> int:
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    fetcher = BatchFetcher(headers)
+    processed = 0
+    while True:
+        jobs = []
+        while len(jobs) < batch_size:
+            job = queue.lease(worker_id)
+            if job is None:
+                break
+            logging.info(f"Worker {worker_id} leased job {job['id']} ({job['cited_id']} <- {job['citing_id']}), attempt {job['attempts']}")
+            jobs.append(job)
+        if not jobs:
+            if exit_when_idle:
+                return processed
+            time.sleep(poll_interval)
+            continue
+
+        # One opinions request covers every job in the lease batch
+        opinions = [job['payload']['opinion'] for job in jobs]
+        fetcher.prefetch('opinions', [opinion['opinions'][0]['id'] for opinion in opinions
+                                      if opinion.get('opinions') and opinion['opinions'][0].get('id') and not opinion.get('passages')])
+
+        # Jobs run in parallel, but only this thread touches the queue connection
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            outcomes = list(executor.map(lambda job: run_job(job, headers, genai_model, fetcher), jobs))
+        for job, (result, error) in zip(jobs, outcomes):
+            if result:
+                queue.ack(job, result)
+                processed += 1
+            else:
+                queue.fail(job, error)
+
+def collect_results(opinion_id: str, queue: JobQueue) -> Tuple[str, List[Dict[str, Any]]]:
+    return queue.main_case_name(opinion_id), queue.results(opinion_id)
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue-backed Opinion Citation Analyzer")
+    parser.add_argument('--db', default=QUEUE_DB, help="Path to the SQLite queue database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = subparsers.add_parser('enqueue', help="Enqueue the citing opinions of one or more opinion IDs")
+    enqueue_parser.add_argument('opinion_ids', nargs='+')
+    enqueue_parser.add_argument('--limit', type=int, help="Enqueue at most this many citing opinions per opinion ID")
+    enqueue_parser.add_argument('--index', help="Path to a local citation index database built with citator_index.py")
+
+    work_parser = subparsers.add_parser('work', help="Run a worker against the queue")
+    work_parser.add_argument('--visibility-timeout', type=float, default=600)
+    work_parser.add_argument('--max-attempts', type=int, default=3)
+    work_parser.add_argument('--exit-when-idle', action='store_true')
+    work_parser.add_argument('--batch-size', type=int, default=10, help="Jobs leased, fetched and processed together")
+
+    status_parser = subparsers.add_parser('status', help="Show job counts by status")
+    status_parser.add_argument('opinion_id', nargs='?')
+
+    requeue_parser = subparsers.add_parser('requeue', help="Move dead-lettered jobs back to pending")
+    requeue_parser.add_argument('opinion_id', nargs='?')
+
+    collect_parser = subparsers.add_parser('collect', help="Save finished results for an opinion ID")
+    collect_parser.add_argument('opinion_id')
+
+    args = parser.parse_args()
+
+    headers = {
+        'Authorization': f"Token {os.getenv('AUTH_TOKEN', '')}"
+    }
+
+    if args.command == 'work':
+        queue = JobQueue(args.db, visibility_timeout=args.visibility_timeout, max_attempts=args.max_attempts)
+        genai.configure(api_key=os.getenv('GENAI_API_KEY'))
+        genai_model = genai.GenerativeModel("gemini-1.5-pro-latest")
+        processed = run_worker(queue, headers, genai_model, exit_when_idle=args.exit_when_idle, batch_size=args.batch_size)
+        print(f"Processed {processed} jobs")
+        return
+
+    queue = JobQueue(args.db)
+    if args.command == 'enqueue':
+        fetcher = BatchFetcher(headers)
+        fetcher.prefetch('clusters', args.opinion_ids)
+        index = CitationIndex(args.index) if args.index else None
+        for opinion_id in args.opinion_ids:
+            enqueue_opinion(opinion_id, headers, queue, index, limit=args.limit, fetcher=fetcher)
+    elif args.command == 'status':
+        print(json.dumps(queue.counts(args.opinion_id), indent=2))
+    elif args.command == 'requeue':
+        print(f"Requeued {queue.requeue_dead(args.opinion_id)} dead jobs")
+    elif args.command == 'collect':
+        main_case_name, results = collect_results(args.opinion_id, queue)
+        output_filename = f'processed_opinions_{args.opinion_id}.json'
+        save_results_to_file(main_case_name, results, output_filename)
+        print(f"Saved {len(results)} results for {main_case_name} to: {output_filename}")
+
+if __name__ == "__main__":
+    main()
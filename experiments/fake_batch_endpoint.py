@@ -0,0 +1,124 @@
+import re
+import sys
+import html
+import json
+import uuid
+import time
+from email.parser import BytesParser
+from email.policy import default
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any
+
+# A minimal OpenAI-compatible endpoint for exercising citator_batch.py offline:
+#   python experiments/fake_batch_endpoint.py 8765
+#   python citator_batch.py 94508 --batch-api --base-url http://localhost:8765/v1 --poll-interval 1
+# Every citing opinion in a request is answered as "mentioned".
+
+FILES: Dict[str, bytes] = {}
+BATCHES: Dict[str, Dict[str, Any]] = {}
+
+def fake_completion(body: Dict[str, Any]) -> Dict[str, Any]:
+    prompt = body['messages'][-1]['content']
+    citing_cases = [
+        {"name": html.unescape(name), "citation": "Unknown", "citing_id": html.unescape(citing_id), "label": "mentioned", "color": "Purple",
+         "reasoning": "Answered by the fake batch endpoint."}
+        for citing_id, name in re.findall(r'<citing_opinion citing_id="([^"]*)" name="([^"]*)"', prompt)
+    ]
+    arguments = json.dumps({"cited_case": {"name": "Unknown", "citation": "Unknown"}, "citing_cases": citing_cases})
+    tool_name = body['tools'][0]['function']['name'] if body.get('tools') else "BatchCitationAnalysis"
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get('model', "gpt-4o"),
+        "choices": [{
+            "index": 0,
+            "finish_reason": "tool_calls",
+            "message": {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{"id": f"call_{uuid.uuid4().hex}", "type": "function", "function": {"name": tool_name, "arguments": arguments}}],
+            },
+        }],
+        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(arguments) // 4, "total_tokens": (len(prompt) + len(arguments)) // 4},
+    }
+
+def file_object(file_id: str, purpose: str) -> Dict[str, Any]:
+    return {"id": file_id, "object": "file", "bytes": len(FILES[file_id]), "created_at": int(time.time()),
+            "filename": f"{file_id}.jsonl", "purpose": purpose, "status": "processed"}
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def send_json(self, payload: Dict[str, Any], status: int = 200) -> None:
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path.endswith("/chat/completions"):
+            self.send_json(fake_completion(json.loads(body)))
+        elif self.path.endswith("/files"):
+            message = BytesParser(policy=default).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + body
+            )
+            fields = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True) for part in message.iter_parts()}
+            file_id = f"file-{uuid.uuid4().hex}"
+            FILES[file_id] = fields.get('file', b"")
+            self.send_json(file_object(file_id, (fields.get('purpose') or b"batch").decode('utf-8')))
+        elif self.path.endswith("/batches"):
+            request = json.loads(body)
+            output_lines = []
+            for line in FILES[request['input_file_id']].decode('utf-8').splitlines():
+                if line.strip():
+                    record = json.loads(line)
+                    output_lines.append(json.dumps({
+                        "id": f"batch_req_{uuid.uuid4().hex}",
+                        "custom_id": record['custom_id'],
+                        "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": fake_completion(record['body'])},
+                        "error": None,
+                    }))
+            output_file_id = f"file-{uuid.uuid4().hex}"
+            FILES[output_file_id] = ("\n".join(output_lines) + "\n").encode('utf-8')
+            batch_id = f"batch_{uuid.uuid4().hex}"
+            # The first poll reports the batch as still running, like the real service would
+            BATCHES[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": request['endpoint'], "input_file_id": request['input_file_id'],
+                "completion_window": request['completion_window'], "status": "in_progress", "created_at": int(time.time()),
+                "output_file_id": output_file_id,
+            }
+            self.send_json(BATCHES[batch_id])
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+    def do_GET(self):
+        match = re.search(r"/batches/([^/]+)$", self.path)
+        if match and match.group(1) in BATCHES:
+            batch = dict(BATCHES[match.group(1)])
+            BATCHES[match.group(1)]['status'] = "completed"
+            self.send_json(batch)
+            return
+        match = re.search(r"/files/([^/]+)/content$", self.path)
+        if match and match.group(1) in FILES:
+            data = FILES[match.group(1)]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self.send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    server = ThreadingHTTPServer(("localhost", port), FakeOpenAIHandler)
+    print(f"Fake batch endpoint listening on http://localhost:{port}/v1")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,8 @@ from openai import OpenAI
 from enum import Enum
 from pydantic import BaseModel, Field
 
+from citator import Label, Color, BatchFetcher, get_opinion_text
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -44,24 +46,6 @@ genai.configure(api_key=GENAI_API_KEY)
 
 client = OpenAI(api_key=OPENAI_API_KEY)
 
-class Label(str, Enum):
-    followed = "followed"
-    distinguished = "distinguished"
-    partially_overruled = "partially overruled"
-    overruled = "overruled"
-    rejected = "rejected"
-    declined_to_follow = "declined to follow"
-    mentioned = "mentioned"
-
-class Color(str, Enum):
-    Green = "Green"
-    Blue = "Blue"
-    Yellow = "Yellow"
-    Red = "Red"
-    Gray = "Gray"
-    Orange = "Orange"
-    Purple = "Purple"
-
 class Case(BaseModel):
     name: str
     citation: str
@@ -120,9 +104,8 @@ st.write("""
          
          """)
 
-def get_case_name(opinion_id: str) -> str:
-    url = f"{BASE_URL}/clusters/{opinion_id}/"
-    data = make_request(url)
+def get_case_name(opinion_id: str, fetcher: Optional[BatchFetcher] = None) -> str:
+    data = (fetcher or BatchFetcher(HEADERS, base_url=BASE_URL)).get('clusters', opinion_id)
     if data:
         return data.get('case_name') or data.get('case_name_full') or "Unknown Case Name"
     return "Unknown Case Name"
@@ -206,23 +189,11 @@ def process_single_opinion(main_case_name: str, citing_case_name: str, date: str
         print(f"Error processing opinion {citing_case_name}: {str(e)}")
         return None
 
-def process_opinion_worker(main_case_name: str, opinion: Dict[str, Any]) -> Dict[str, Any]:
+def process_opinion_worker(main_case_name: str, opinion: Dict[str, Any], fetcher: Optional[BatchFetcher] = None) -> Dict[str, Any]:
     citing_case_name = opinion.get('caseName') or opinion.get('caseNameFull', 'Unknown Case Name')
     date_filed = opinion.get('dateFiled', 'Unknown Date')
     
-    content = None
-    if opinion.get('opinions'):
-        first_opinion = opinion['opinions'][0]
-        opinion_id = first_opinion.get('id')
-        if opinion_id:
-            opinion_url = f"{BASE_URL}/opinions/{opinion_id}/"
-            logging.info(f"Fetching full opinion data from: {opinion_url}")
-            opinion_data = make_request(opinion_url)
-            if opinion_data:
-                content = opinion_data.get('plain_text') or opinion_data.get('html') or \
-                        opinion_data.get('html_lawbox') or opinion_data.get('html_columbia') or \
-                        opinion_data.get('html_anon_2020') or opinion_data.get('xml_harvard') or \
-                        opinion_data.get('html_with_citations')
+    content = get_opinion_text(opinion, HEADERS, fetcher or BatchFetcher(HEADERS, base_url=BASE_URL))
     
     if content:
         processed_result = process_single_opinion(main_case_name, citing_case_name, date_filed, content)
@@ -245,18 +216,24 @@ def set_search_input(value):
 def on_text_input_change():
     st.session_state.opinion_id = st.session_state.temp_opinion_id
 
-def process_opinion(opinion_id: str) -> Tuple[str, List[Dict[str, Any]]]:
-    main_case_name = get_case_name(opinion_id)
+def process_opinion(opinion_id: str, main_case_name: Optional[str] = None) -> Tuple[str, List[Dict[str, Any]]]:
+    fetcher = BatchFetcher(HEADERS, base_url=BASE_URL)
+    if main_case_name is None:
+        main_case_name = get_case_name(opinion_id, fetcher)
     logging.info(f"Main Case Name for opinion {opinion_id}: {main_case_name}")
     
     logging.info(f"Fetching citing opinions for opinion ID: {opinion_id}")
     citing_opinions = get_citing_opinions(opinion_id)
     
+    # Queue every opinion fetch up front so all citing opinions share one id__in request
+    fetcher.prefetch('opinions', [opinion['opinions'][0]['id'] for opinion in citing_opinions
+                                  if opinion.get('opinions') and opinion['opinions'][0].get('id')])
+    
     logging.info(f"Processing the first {len(citing_opinions)} citing opinions in parallel...")
     results = []
     
     with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_opinion = {executor.submit(process_opinion_worker, main_case_name, opinion): opinion for opinion in citing_opinions}
+        future_to_opinion = {executor.submit(process_opinion_worker, main_case_name, opinion, fetcher): opinion for opinion in citing_opinions}
         for future in concurrent.futures.as_completed(future_to_opinion):
             result = future.result()
             if result:
@@ -286,7 +263,7 @@ if st.session_state.opinion_id:
         st.write(f"Main Case: {main_case_name}")
 
     with st.spinner("Processing citing opinions..."):
-        main_case_name, results = process_opinion(st.session_state.opinion_id)
+        main_case_name, results = process_opinion(st.session_state.opinion_id, main_case_name)
 
 
     COLOR_ICONS = {